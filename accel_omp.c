@@ -0,0 +1,30 @@
+/* Direct-sum accelerations in C with OpenMP, for when numba is not available (see physics_c.py).
+ * pos is (n, 3) and acc is (n, 3), both C-contiguous, mass is (n,); acc is overwritten.
+ * Build with:
+ *     gcc -O3 -march=native -ffast-math -fopenmp -shared -fPIC accel_omp.c -o libaccel_omp.so
+ */
+#include <math.h>
+
+void accel(const double *pos, const double *mass, double *acc, int n, double G, double eps2)
+{
+    int i, j;
+#pragma omp parallel for schedule(static) private(j)
+    for (i = 0; i < n; i++) {
+        const double x_i = pos[3 * i], y_i = pos[3 * i + 1], z_i = pos[3 * i + 2];
+        double ax = 0.0, ay = 0.0, az = 0.0;
+        for (j = 0; j < n; j++) {
+            const double dx = pos[3 * j] - x_i;
+            const double dy = pos[3 * j + 1] - y_i;
+            const double dz = pos[3 * j + 2] - z_i;
+            const double r2 = dx * dx + dy * dy + dz * dz + eps2;
+            /* branchless self-interaction: the j == i term is multiplied by 0 */
+            const double s = (j != i) * G * mass[j] / (r2 * sqrt(r2) + (j == i));
+            ax += s * dx;
+            ay += s * dy;
+            az += s * dz;
+        }
+        acc[3 * i] = ax;
+        acc[3 * i + 1] = ay;
+        acc[3 * i + 2] = az;
+    }
+}
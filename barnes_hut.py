@@ -0,0 +1,242 @@
+# Barnes-Hut approximation of the gravitational accelerations, O(n log n) instead of O(n^2):
+# far away groups of planets are replaced by a single pseudo-planet at their center of mass.
+# The octree is stored in flat arrays, children always have a larger index than their parent.
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional, the same code then runs as (slow) plain python
+    prange = range
+
+    def njit(*args, **kwargs):
+        def decorator(f):
+            return f
+        return decorator
+
+MORTON_BITS = 21  # bits per axis of the Morton codes, 63 in total: the tree is at most this deep
+MAX_DEPTH = MORTON_BITS  # cells are not split any further, coincident planets end up in the same leaf
+
+
+@njit(cache=True)
+def _spread_bits(v):
+    # inserts two zero bits between each of the lower 21 bits of v
+    v = (v | (v << 32)) & 0x1f00000000ffff
+    v = (v | (v << 16)) & 0x1f0000ff0000ff
+    v = (v | (v << 8)) & 0x100f00f00f00f00f
+    v = (v | (v << 4)) & 0x10c30c30c30c30c3
+    v = (v | (v << 2)) & 0x1249249249249249
+    return v
+
+
+@njit(cache=True)
+def morton_codes(pos, origin, width):
+    # interleaved bits of the coordinates scaled to [0, 2^21) inside the cube: x gives bit 0 of every
+    # 3-bit digit, y bit 1 and z bit 2, the same numbering as the octants of a cell
+    n = pos.shape[0]
+    scale = (1 << MORTON_BITS) / width
+    top = (1 << MORTON_BITS) - 1
+    codes = np.empty(n, dtype=np.int64)
+    for i in range(n):
+        code = 0
+        for d in range(3):
+            q = min(max(np.int64((pos[i, d] - origin[d]) * scale), 0), top)
+            code |= _spread_bits(q) << d
+        codes[i] = code
+    return codes
+
+
+@njit(cache=True)
+def _grow(center, width, child, start, count, depth, leaf, capacity):
+    n_old = width.shape[0]
+    new_center = np.empty((capacity, 3))
+    new_width = np.empty(capacity)
+    new_child = np.empty((capacity, 8), dtype=np.int64)
+    new_start = np.empty(capacity, dtype=np.int64)
+    new_count = np.empty(capacity, dtype=np.int64)
+    new_depth = np.empty(capacity, dtype=np.int64)
+    new_leaf = np.empty(capacity, dtype=np.bool_)
+    new_center[:n_old] = center
+    new_width[:n_old] = width
+    new_child[:n_old] = child
+    new_start[:n_old] = start
+    new_count[:n_old] = count
+    new_depth[:n_old] = depth
+    new_leaf[:n_old] = leaf
+    return new_center, new_width, new_child, new_start, new_count, new_depth, new_leaf
+
+
+# the planets are sorted once by Morton code: the planets of every cell, and of each of its
+# octants, are then contiguous runs of the sorted order, found with a single scan of the cell
+@njit(cache=True)
+def build_octree(pos, mass):
+    n = pos.shape[0]
+    capacity = 2 * n + 8
+    center = np.empty((capacity, 3))
+    width = np.empty(capacity)  # edge length of the (cubic) cell
+    child = np.empty((capacity, 8), dtype=np.int64)  # -1 when the octant is empty
+    start = np.empty(capacity, dtype=np.int64)  # the planets of a cell are order[start:start + count]
+    count = np.empty(capacity, dtype=np.int64)
+    depth = np.empty(capacity, dtype=np.int64)
+    leaf = np.empty(capacity, dtype=np.bool_)
+
+    # root cell: bounding cube of all planets
+    lo = np.empty(3)
+    hi = np.empty(3)
+    for d in range(3):
+        lo[d] = pos[0, d]
+        hi[d] = pos[0, d]
+    for i in range(1, n):
+        for d in range(3):
+            lo[d] = min(lo[d], pos[i, d])
+            hi[d] = max(hi[d], pos[i, d])
+    root_width = 0.0
+    for d in range(3):
+        center[0, d] = 0.5 * (lo[d] + hi[d])
+        root_width = max(root_width, hi[d] - lo[d])
+    width[0] = root_width * (1.0 + 1e-9) if root_width > 0.0 else 1.0
+    child[0, :] = -1
+    start[0] = 0
+    count[0] = n
+    depth[0] = 0
+    leaf[0] = True
+
+    origin = np.empty(3)
+    for d in range(3):
+        origin[d] = center[0, d] - 0.5 * width[0]
+    codes = morton_codes(pos, origin, width[0])
+    order = np.argsort(codes)
+    codes = codes[order]
+
+    n_nodes = 1
+    max_depth = 0
+    k = 0
+    while k < n_nodes:
+        c = count[k]
+        if c > 1 and depth[k] < MAX_DEPTH:
+            if n_nodes + 8 > capacity:
+                capacity *= 2
+                center, width, child, start, count, depth, leaf = \
+                    _grow(center, width, child, start, count, depth, leaf, capacity)
+
+            leaf[k] = False
+            shift = 3 * (MORTON_BITS - 1 - depth[k])
+            quarter = 0.25 * width[k]
+            m = start[k]
+            end = m + c
+            while m < end:
+                # the run of planets in octant o of the cell
+                o = (codes[m] >> shift) & 7
+                run_start = m
+                while m < end and ((codes[m] >> shift) & 7) == o:
+                    m += 1
+                q = n_nodes
+                n_nodes += 1
+                center[q, 0] = center[k, 0] + (quarter if o & 1 else -quarter)
+                center[q, 1] = center[k, 1] + (quarter if o & 2 else -quarter)
+                center[q, 2] = center[k, 2] + (quarter if o & 4 else -quarter)
+                width[q] = 0.5 * width[k]
+                child[q, :] = -1
+                start[q] = run_start
+                count[q] = m - run_start
+                depth[q] = depth[k] + 1
+                leaf[q] = True
+                child[k, o] = q
+                max_depth = max(max_depth, depth[q])
+        k += 1
+
+    # total mass and center of mass, bottom-up
+    node_mass = np.zeros(n_nodes)
+    com = np.zeros((n_nodes, 3))
+    for k in range(n_nodes - 1, -1, -1):
+        m_k = 0.0
+        x_k = 0.0
+        y_k = 0.0
+        z_k = 0.0
+        if leaf[k]:
+            for m in range(start[k], start[k] + count[k]):
+                b = order[m]
+                m_k += mass[b]
+                x_k += mass[b] * pos[b, 0]
+                y_k += mass[b] * pos[b, 1]
+                z_k += mass[b] * pos[b, 2]
+        else:
+            for o in range(8):
+                q = child[k, o]
+                if q >= 0:
+                    m_k += node_mass[q]
+                    x_k += node_mass[q] * com[q, 0]
+                    y_k += node_mass[q] * com[q, 1]
+                    z_k += node_mass[q] * com[q, 2]
+        node_mass[k] = m_k
+        if m_k > 0.0:
+            com[k, 0] = x_k / m_k
+            com[k, 1] = y_k / m_k
+            com[k, 2] = z_k / m_k
+        else:
+            com[k, 0] = center[k, 0]
+            com[k, 1] = center[k, 1]
+            com[k, 2] = center[k, 2]
+
+    return width[:n_nodes], com, node_mass, child[:n_nodes], leaf[:n_nodes], \
+        start[:n_nodes], count[:n_nodes], order, max_depth
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _walk(pos, mass, acc, G, eps2, theta, width, com, node_mass, child, leaf, start, count, order, max_depth):
+    n = pos.shape[0]
+    theta2 = theta * theta
+    gm = G * mass
+    node_gm = G * node_mass
+    # planets in Morton order: consecutive iterations, on the same thread, walk almost the same cells
+    for ii in prange(n):
+        i = order[ii]
+        x_i = pos[i, 0]
+        y_i = pos[i, 1]
+        z_i = pos[i, 2]
+        ax = 0.0
+        ay = 0.0
+        az = 0.0
+        stack = np.empty(7 * max_depth + 8, dtype=np.int64)
+        stack[0] = 0
+        top = 1
+        while top > 0:
+            top -= 1
+            k = stack[top]
+            if leaf[k]:
+                for m in range(start[k], start[k] + count[k]):
+                    b = order[m]
+                    if b == i:
+                        continue
+                    dx = pos[b, 0] - x_i
+                    dy = pos[b, 1] - y_i
+                    dz = pos[b, 2] - z_i
+                    r2 = dx * dx + dy * dy + dz * dz + eps2
+                    s = gm[b] * r2 ** -1.5
+                    ax += s * dx
+                    ay += s * dy
+                    az += s * dz
+            else:
+                dx = com[k, 0] - x_i
+                dy = com[k, 1] - y_i
+                dz = com[k, 2] - z_i
+                r2 = dx * dx + dy * dy + dz * dz
+                if width[k] * width[k] < theta2 * r2:
+                    # far enough: the whole cell acts as a single pseudo-planet
+                    s = node_gm[k] * (r2 + eps2) ** -1.5
+                    ax += s * dx
+                    ay += s * dy
+                    az += s * dz
+                else:
+                    for o in range(8):
+                        q = child[k, o]
+                        if q >= 0:
+                            stack[top] = q
+                            top += 1
+        acc[i, 0] = ax
+        acc[i, 1] = ay
+        acc[i, 2] = az
+
+
+def accel_bh(pos, mass, acc, G, eps2=0.0, theta=0.5):
+    width, com, node_mass, child, leaf, start, count, order, max_depth = build_octree(pos, mass)
+    _walk(pos, mass, acc, G, eps2, theta, width, com, node_mass, child, leaf, start, count, order, max_depth)
@@ -1,57 +1,88 @@
-from planet import planet, check_for_colliding_planets, append_positions, set_up_positions, \
+from planet import planet, PlanetSystem, check_for_colliding_planets, snapshot_history, set_up_history, \
     random_sun, random_earth, static_sun, static_earth, M_sun, R_sun, V_earth, D_earth_sun, M_earth
-from physics import compute_accelerations, stable_circular_orbit_earth
+from physics import compute_accelerations, compute_system_accelerations, make_stepper, euler_step, \
+    stable_circular_orbit_earth
 from plots import set_up_plot, update_plot
 from constants import D_earth_sun, D_earth_moon
 
 from mpl_toolkits.mplot3d import Axes3D
 import matplotlib.pyplot as plt
+import numpy as np
+import sys
 
 time_horizon = 5.0  # in years
 time_delta = 0.5  # in days
+report_freq = 100  # in steps
+plot_update_freq = 10  # in steps
 days_to_sec = 24.0 * 60.0 * 60.0
 days_to_years = 1.0 / 365.25
 
 
 # Horizon is on years, step is in days
-def planet_dynamics(horizon, step, make_plot=True):
+# With verbose=True the state of all planets is printed every report_freq steps,
+# with make_plot=True the plot is redrawn every plot_update_freq steps.
+# integrator is 'leapfrog' (velocity Verlet) or 'euler' (the original first order scheme).
+# history_dtype=np.float32 halves the memory of the recorded trajectories, enough for plotting
+# but with only ~7 significant digits in the returned positions
+def planet_dynamics(horizon, step, make_plot=True, verbose=False, report_freq=report_freq,
+                    plot_update_freq=plot_update_freq, integrator='leapfrog', history_dtype=np.float64):
+    integrators = ['leapfrog', 'euler']
+    if integrator not in integrators:
+        raise ValueError("unknown integrator %r, expected one of %s" % (integrator, integrators))
+
     delta_in_sec = step * days_to_sec
+    step_in_years = step * days_to_years
 
     # define your planets here
     planets = [static_sun("1"),
                planet("2", R_sun, M_earth, D_earth_sun, 0.0, 0.0, 0.0, V_earth, 0.0)]
 
-    x, y, z = [[]], [[]], [[]]
-    set_up_positions(x, y, z, len(planets))
+    system = PlanetSystem(planets)
+    compute_system_accelerations(system)  # prime the accelerations for the first kick
+    if integrator == 'leapfrog':
+        integrator_step = make_stepper(system, delta_in_sec)
+    else:
+        def integrator_step(s):
+            euler_step(s, delta_in_sec)
+    # steppers that keep the system on a GPU only update the positions on the host after each step
+    sync = getattr(integrator_step, 'sync', None)
+
+    n_steps = int(horizon / step_in_years) + 2
+    history = set_up_history(len(system), n_steps, history_dtype)
     lines = []
     if make_plot:
-        set_up_plot(lines, x, y, z, planets)
+        axes = set_up_plot(lines, history[:, :0], system)
 
+    k = 0
     total_time = 0  # in years
     while total_time <= horizon:
 
-        print("Time (in y): ", total_time, " --- Number of planets: ", len(planets))
+        if verbose and k % report_freq == 0:
+            if sync is not None:
+                sync(system)
+            sys.stdout.write("Time (in y):  %s  --- Number of planets:  %d\n%s\n"
+                             % (total_time, len(system), system.summary()))
 
-        for p in planets:
-            p.report()
-        append_positions(x, y, z, planets)
-        if make_plot:
-            update_plot(lines, x, y, z, planets, total_time)
+        snapshot_history(history, k, system.pos)
+        k += 1
+        if make_plot and (k - 1) % plot_update_freq == 0:
+            update_plot(lines, axes, history[:, :k], system, total_time)
 
-        compute_accelerations(planets)
-        for p in planets:
-            p.update_velocity(delta_in_sec)
-            p.update_position(delta_in_sec)
+        integrator_step(system)
 
-        # planets = check_for_colliding_planets(planets)
+        # system = PlanetSystem(check_for_colliding_planets(system.to_planets()))
 
-        total_time += step * days_to_years  # in years
+        total_time += step_in_years
 
+    if sync is not None:
+        sync(system)
     if make_plot:
+        update_plot(lines, axes, history[:, :k], system, total_time - step_in_years)  # full trajectories
         plt.show()
-    return x, y, z
+    # x[i], y[i], z[i] are the trajectory of planet i (views on the history)
+    return history[:, :k, 0], history[:, :k, 1], history[:, :k, 2]
 
 
 if __name__ == '__main__':
-    planet_dynamics(time_horizon, time_delta)
+    planet_dynamics(time_horizon, time_delta, verbose=True)
 
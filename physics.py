@@ -1,46 +1,240 @@
-from planet import planet, distance_between_planets, static_earth
+from planet import planet, PlanetSystem, static_earth
 from typing import List
 from constants import G
+import numpy as np
 
+try:
+    from physics_numba import accel_kernel, accel_kernel_symmetric, accel_kick_kernel, kick_drift_kernel, \
+        accel_kernel_f32, make_verlet_step
+    from numba import get_num_threads
+    from barnes_hut import accel_bh
+except ImportError:  # numba is optional, fall back to the ahead of time kernels or to the NumPy kernel
+    accel_kernel_f32 = None
+    make_verlet_step = None
+    accel_bh = None
+    try:
+        # the same kernels compiled ahead of time, see physics_aot.py. They run on a single thread,
+        # so they are only used without numba: its JIT kernels are multi-threaded
+        from nbody_kernels import accel_kernel, accel_kernel_symmetric, accel_kick_kernel, kick_drift_kernel
 
-def gravitational_force(p1, p2):
-    d = distance_between_planets(p1, p2)
-    f = G * p1.mass * p2.mass / (d * d)
-    return f
+        def get_num_threads():
+            return 1
+    except ImportError:
+        accel_kernel = None
+        accel_kernel_symmetric = None
+        accel_kick_kernel = None
+        kick_drift_kernel = None
+        get_num_threads = None
+
+try:
+    # the OpenMP kernel in accel_omp.c, only used without numba and without physics_aot.py's module
+    from physics_c import accel_c
+except ImportError:
+    accel_c = None
+
+try:
+    from numba import cuda
+    from physics_cuda import accel_gpu, DeviceStepper
+    if not cuda.is_available():
+        accel_gpu = None
+        DeviceStepper = None
+except ImportError:
+    accel_gpu = None
+    DeviceStepper = None
+
+SYMMETRIC_THRESHOLD = 64  # up to this many planets the serial pair kernel beats the tiled one
+BARNES_HUT_THRESHOLD = 4096  # above this many planets the forces are approximated with an octree
+BARNES_HUT_THETA = 0.5  # opening angle: cells seen under a smaller angle act as a single planet
+GPU_THRESHOLD = 1024  # above this many planets the exact sum on the GPU (if any) beats the CPU kernels
+BACKENDS = (None, 'cpu', 'cuda')  # see accelerations
+
+
+# G is bound as a default argument so that it is a fast local lookup instead of a global one,
+# and the squared distance is inlined: no function call, and no sqrt since F ~ 1 / r^2
+def gravitational_force(p1, p2, _G=G):
+    dx = p1.x - p2.x
+    dy = p1.y - p2.y
+    dz = p1.z - p2.z
+    return _G * p1.mass * p2.mass / (dx * dx + dy * dy + dz * dz)
+
+
+# gravitational_force for arrays of pairs: the magnitude of the force between the planets at
+# pos_a[i] and pos_b[i], (n, 3) arrays, with masses m_a[i] and m_b[i]. Anything that broadcasts
+# works, e.g. a single planet against many
+def gravitational_force_batch(pos_a, m_a, pos_b, m_b, _G=G):
+    d = np.subtract(pos_a, pos_b)
+    r2 = np.einsum('...k,...k->...', d, d)
+    return _G * np.multiply(m_a, m_b) / r2
 
 
 def gravitational_acceleration(f, p):
-    return (f / p.mass) ** 0.5
+    return f / p.mass
+
+
+# scratch buffers for compute_accelerations, only reallocated when the number of planets changes
+_pos = np.empty((0, 3))
+_mass = np.empty(0)
+_acc = np.empty((0, 3))
+
+
+def _scratch_arrays(n):
+    global _pos, _mass, _acc
+    if _mass.shape[0] != n:
+        _pos = np.empty((n, 3))
+        _mass = np.empty(n)
+        _acc = np.empty((n, 3))
+    return _pos, _mass, _acc
+
+
+# eps2 is the squared softening length: r^2 + eps2 is used instead of r^2,
+# which keeps close encounters finite (0 for plain Newtonian gravity)
+def accelerations_numpy(pos, mass, acc, eps2=0.0, _G=G):
+    # d[i, j] is the vector going from planet i to planet j
+    d = pos[None, :, :] - pos[:, None, :]
+    r2 = np.einsum('ijk,ijk->ij', d, d)
+    r2 += eps2
+    np.fill_diagonal(r2, np.inf)  # no self-interaction: r^-3 == 0 on the diagonal
+    # r^-3 as 1 / (r^2 sqrt(r^2)): a sqrt, a product and a reciprocal are cheaper than a pow
+    w = np.sqrt(r2)
+    w *= r2
+    np.reciprocal(w, out=w)
+    w *= _G * mass[None, :]
+    # acc[i] = sum_j w[i, j] * d[i, j], contracted without an (n, n, 3) temporary
+    np.einsum('ijk,ij->ik', d, w, out=acc)
+
+
+# the two-body problem (the default set-up) without any array machinery
+def _accelerations_two_body(pos, mass, acc, eps2=0.0, _G=G):
+    (x_a, y_a, z_a), (x_b, y_b, z_b) = pos.tolist()
+    m_a, m_b = mass.tolist()
+    dx = x_b - x_a
+    dy = y_b - y_a
+    dz = z_b - z_a
+    inv_r3 = (dx * dx + dy * dy + dz * dz + eps2) ** -1.5
+    s_a = _G * m_b * inv_r3
+    s_b = _G * m_a * inv_r3
+    acc[0] = s_a * dx, s_a * dy, s_a * dz
+    acc[1] = -s_b * dx, -s_b * dy, -s_b * dz
 
 
-def compute_accelerations(planets: List[planet]):
+# backend is 'cuda' to force the GPU kernel, 'cpu' to never use it, or None to use it whenever
+# a GPU is available and there are enough planets in float64 (float32 arrays go to accel_kernel_f32)
+def accelerations(pos, mass, acc, eps2=0.0, backend=None, _G=G):
+    if backend not in BACKENDS:
+        raise ValueError("unknown backend %r, expected one of %s" % (backend, BACKENDS))
+    if backend == 'cuda' or (backend is None and accel_gpu is not None and len(mass) > GPU_THRESHOLD
+                             and pos.dtype == np.float64):
+        if accel_gpu is None:
+            raise RuntimeError("the cuda backend needs numba and a CUDA capable GPU")
+        accel_gpu(pos, mass, acc, _G, eps2)
+    elif pos.dtype == np.float32:
+        if accel_kernel_f32 is not None:
+            accel_kernel_f32(pos, mass, acc, _G, eps2, get_num_threads())
+        else:
+            # r^-3 of astronomical distances is out of the float32 range, the NumPy path needs float64
+            acc_64 = np.empty(acc.shape)
+            accelerations_numpy(pos.astype(np.float64), mass.astype(np.float64), acc_64, eps2, _G)
+            acc[:] = acc_64
+    elif accel_bh is not None and len(mass) > BARNES_HUT_THRESHOLD:
+        accel_bh(pos, mass, acc, _G, eps2, BARNES_HUT_THETA)
+    elif accel_kernel is not None:
+        if len(mass) > SYMMETRIC_THRESHOLD:
+            accel_kernel(pos, mass, acc, _G, eps2, get_num_threads())
+        else:
+            accel_kernel_symmetric(pos, mass, acc, _G, eps2)
+    elif len(mass) == 2:
+        _accelerations_two_body(pos, mass, acc, eps2, _G)
+    elif accel_c is not None:
+        accel_c(pos, mass, acc, _G, eps2)
+    else:
+        accelerations_numpy(pos, mass, acc, eps2, _G)
+
+
+# planets is a list of planets, or a PlanetSystem whose arrays are then used in place
+# (with the softening of the system)
+def compute_accelerations(planets: List[planet], softening=0.0, backend=None, _G=G):
+    if isinstance(planets, PlanetSystem):
+        return compute_system_accelerations(planets, backend, _G)
+    if backend not in BACKENDS:
+        raise ValueError("unknown backend %r, expected one of %s" % (backend, BACKENDS))
     n = len(planets)
+    if n == 2 and backend != 'cuda':
+        # two-body fast path straight on the planet attributes, no copies to and from arrays
+        a, b = planets
+        dx = b.x - a.x
+        dy = b.y - a.y
+        dz = b.z - a.z
+        inv_r3 = (dx * dx + dy * dy + dz * dz + softening * softening) ** -1.5
+        s_a = _G * b.mass * inv_r3
+        s_b = _G * a.mass * inv_r3
+        a.x_a = s_a * dx
+        a.y_a = s_a * dy
+        a.z_a = s_a * dz
+        b.x_a = -s_b * dx
+        b.y_a = -s_b * dy
+        b.z_a = -s_b * dz
+        return 0
+
+    pos, mass, acc = _scratch_arrays(n)
+    for i, p in enumerate(planets):
+        pos[i, 0] = p.x
+        pos[i, 1] = p.y
+        pos[i, 2] = p.z
+        mass[i] = p.mass
+
+    accelerations(pos, mass, acc, softening * softening, backend, _G)
+
+    for i, p in enumerate(planets):
+        p.x_a, p.y_a, p.z_a = acc[i].tolist()
+    return 0
+
 
-    i = 0
-    while i < n:
-        planets[i].clear_acceleration()
-        i += 1
-
-    i_lhs = 0
-    while i_lhs < n - 1:
-        p_lhs = planets[i_lhs]
-        i_rhs = i_lhs + 1
-        while i_rhs < n:
-            p_rhs = planets[i_rhs]
-            f = gravitational_force(p_lhs, p_rhs)  # absolute force
-            a_lhs = gravitational_acceleration(f, p_lhs)  # absolute acceleration on p_lhs
-            a_rhs = gravitational_acceleration(f, p_rhs)  # absolute acceleration on p_rhs
-            d = distance_between_planets(p_lhs, p_rhs)
-            d_x = p_rhs.x - p_lhs.x
-            d_y = p_rhs.y - p_lhs.y
-            d_z = p_rhs.z - p_lhs.z
-            planets[i_lhs].append_acceleration(a_lhs * d_x / d, a_lhs * d_y / d, a_lhs * d_z / d)
-            planets[i_rhs].append_acceleration(-a_rhs * d_x / d, -a_rhs * d_y / d, -a_rhs * d_z / d)
-            i_rhs += 1
-        i_lhs += 1
+def compute_system_accelerations(system: PlanetSystem, backend=None, _G=G):
+    accelerations(system.pos, system.mass, system.acc, system.softening * system.softening, backend, _G)
     return 0
 
 
+# one velocity Verlet (kick-drift-kick) step, system.acc must hold the current accelerations
+def verlet_step(system: PlanetSystem, delta_t, _G=G):
+    half_delta_t = 0.5 * delta_t
+    if accel_kick_kernel is not None and len(system) <= BARNES_HUT_THRESHOLD and system.dtype == np.float64:
+        # the same step in two passes: the first kick with the drift, the forces with the second kick
+        kick_drift_kernel(system.pos, system.vel, system.acc, half_delta_t, delta_t)
+        accel_kick_kernel(system.pos, system.mass, system.acc, system.vel,
+                          _G, system.softening * system.softening, half_delta_t, get_num_threads())
+    else:
+        system.update_velocity(half_delta_t)
+        system.update_position(delta_t)
+        compute_system_accelerations(system)
+        system.update_velocity(half_delta_t)
+
+
+# verlet_step specialized for a given system and delta_t, called as step(system). With numba the
+# step is compiled with delta_t, G and the softening as constants, and picks its kernel once
+# for the current number of planets instead of on every step. The ahead of time kernels of
+# physics_aot.py have no such step, without numba they are used through verlet_step. Above GPU_THRESHOLD planets (and a
+# GPU) the system is kept on the device, the step then has a sync(system) method that updates
+# system.vel and system.acc, see physics_cuda.DeviceStepper
+def make_stepper(system: PlanetSystem, delta_t, _G=G):
+    if DeviceStepper is not None and len(system) > GPU_THRESHOLD and system.dtype == np.float64:
+        return DeviceStepper(system, float(delta_t), float(_G), float(system.softening * system.softening))
+    if make_verlet_step is None or len(system) > BARNES_HUT_THRESHOLD or system.dtype != np.float64:
+        return lambda s: verlet_step(s, delta_t, _G)
+    compiled_step = make_verlet_step(float(delta_t), float(_G), float(system.softening * system.softening),
+                                     len(system) <= SYMMETRIC_THRESHOLD)
+
+    def step(s):
+        compiled_step(s.pos, s.vel, s.acc, s.mass, get_num_threads())
+    return step
+
+
+# one explicit (symplectic) Euler step: the original update order (kick then drift), first order
+def euler_step(system: PlanetSystem, delta_t):
+    compute_system_accelerations(system)
+    system.update_velocity(delta_t)
+    system.update_position(delta_t)
+
+
 def stable_circular_orbit_earth(p, x):
     earth = static_earth("earth")
     earth.x = x
@@ -0,0 +1,22 @@
+# ahead-of-time compiled version of the numba kernels: no JIT warm-up, which matters on short runs.
+# Build the nbody_kernels extension module next to this file with:
+#     python physics_aot.py
+# physics.py then uses it when numba is not installed: pycc does not support threads, so the
+# compiled kernels run on a single thread, and with numba its multi-threaded JIT kernels are used.
+from numba.pycc import CC
+from physics_numba import accel_kernel, accel_kernel_symmetric, accel_kick_kernel, kick_drift_kernel
+
+# signatures of the exported kernels, on C-contiguous float64 arrays
+ACCEL_SIGNATURE = 'void(f8[:, ::1], f8[::1], f8[:, ::1], f8, f8, i8)'
+ACCEL_KICK_SIGNATURE = 'void(f8[:, ::1], f8[::1], f8[:, ::1], f8[:, ::1], f8, f8, f8, i8)'
+ACCEL_SYMMETRIC_SIGNATURE = 'void(f8[:, ::1], f8[::1], f8[:, ::1], f8, f8)'
+KICK_DRIFT_SIGNATURE = 'void(f8[:, ::1], f8[:, ::1], f8[:, ::1], f8, f8)'
+
+cc = CC('nbody_kernels')
+cc.export('accel_kernel', ACCEL_SIGNATURE)(accel_kernel.py_func)
+cc.export('accel_kernel_symmetric', ACCEL_SYMMETRIC_SIGNATURE)(accel_kernel_symmetric.py_func)
+cc.export('accel_kick_kernel', ACCEL_KICK_SIGNATURE)(accel_kick_kernel.py_func)
+cc.export('kick_drift_kernel', KICK_DRIFT_SIGNATURE)(kick_drift_kernel.py_func)
+
+if __name__ == '__main__':
+    cc.compile()
@@ -0,0 +1,26 @@
+# ctypes binding of the OpenMP kernel in accel_omp.c, the build command is at the top of that file.
+# Importing this module raises ImportError when the shared library has not been built.
+import ctypes
+import os
+import numpy as np
+
+try:
+    _lib = ctypes.CDLL(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'libaccel_omp.so'))
+except OSError as e:
+    raise ImportError(str(e))
+
+_lib.accel.restype = None
+_lib.accel.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p,
+                       ctypes.c_int, ctypes.c_double, ctypes.c_double]
+
+
+# same interface as accel_kernel. pos and mass are converted to C-contiguous float64 arrays when
+# they are not, and acc is then filled through such a copy: the C code only sees flat buffers
+def accel_c(pos, mass, acc, G, eps2):
+    pos = np.ascontiguousarray(pos, dtype=np.float64)
+    mass = np.ascontiguousarray(mass, dtype=np.float64)
+    out = acc if acc.flags.c_contiguous and acc.dtype == np.float64 else np.empty(acc.shape)
+    _lib.accel(pos.ctypes.data_as(ctypes.c_void_p), mass.ctypes.data_as(ctypes.c_void_p),
+               out.ctypes.data_as(ctypes.c_void_p), pos.shape[0], G, eps2)
+    if out is not acc:
+        acc[:] = out
@@ -0,0 +1,110 @@
+# numba.cuda version of accel_kernel for large systems, one thread per planet:
+# every block of threads loads a tile of TILE planets (position and G * mass) into shared memory
+# with one coalesced read, then all its threads sweep over that tile before loading the next one
+import math
+import numpy as np
+from numba import cuda, float64
+
+TILE = 128  # threads per block, and planets per shared memory tile
+
+
+@cuda.jit(fastmath=True)
+def _accel_tiled(pos, mass, acc, G, eps2):
+    tile = cuda.shared.array((TILE, 4), float64)
+    n = pos.shape[0]
+    i = cuda.grid(1)
+    t = cuda.threadIdx.x
+    x_i = 0.0
+    y_i = 0.0
+    z_i = 0.0
+    if i < n:
+        x_i = pos[i, 0]
+        y_i = pos[i, 1]
+        z_i = pos[i, 2]
+    ax = 0.0
+    ay = 0.0
+    az = 0.0
+    for j0 in range(0, n, TILE):
+        j = j0 + t
+        if j < n:
+            tile[t, 0] = pos[j, 0]
+            tile[t, 1] = pos[j, 1]
+            tile[t, 2] = pos[j, 2]
+            tile[t, 3] = G * mass[j]
+        cuda.syncthreads()
+        for jj in range(min(TILE, n - j0)):
+            if j0 + jj != i:
+                dx = tile[jj, 0] - x_i
+                dy = tile[jj, 1] - y_i
+                dz = tile[jj, 2] - z_i
+                r2 = dx * dx + dy * dy + dz * dz + eps2
+                # sqrt and division map to fast device instructions, a double pow does not
+                s = tile[jj, 3] / (r2 * math.sqrt(r2))
+                ax += s * dx
+                ay += s * dy
+                az += s * dz
+        cuda.syncthreads()
+    if i < n:
+        acc[i, 0] = ax
+        acc[i, 1] = ay
+        acc[i, 2] = az
+
+
+# same interface as accel_kernel: the arrays are copied to the device and acc is copied back.
+# The sums are always in float64, float32 arrays only get their result rounded
+def accel_gpu(pos, mass, acc, G, eps2):
+    n = pos.shape[0]
+    d_pos = cuda.to_device(np.ascontiguousarray(pos))
+    d_mass = cuda.to_device(np.ascontiguousarray(mass))
+    d_acc = cuda.device_array((n, 3), dtype=acc.dtype)
+    n_blocks = (n + TILE - 1) // TILE
+    _accel_tiled[n_blocks, TILE](d_pos, d_mass, d_acc, G, eps2)
+    d_acc.copy_to_host(acc)
+
+
+@cuda.jit(fastmath=True)
+def _kick_drift(pos, vel, acc, kick_t, drift_t):
+    i = cuda.grid(1)
+    if i < pos.shape[0]:
+        for d in range(3):
+            v = vel[i, d] + acc[i, d] * kick_t
+            vel[i, d] = v
+            pos[i, d] += v * drift_t
+
+
+@cuda.jit(fastmath=True)
+def _kick(vel, acc, kick_t):
+    i = cuda.grid(1)
+    if i < vel.shape[0]:
+        for d in range(3):
+            vel[i, d] += acc[i, d] * kick_t
+
+
+# velocity Verlet steps of a PlanetSystem on the GPU, see physics.make_stepper: pos, vel, acc and
+# mass stay on the device between steps and only the positions are copied back to system.pos after
+# each step. sync copies vel and acc back as well, when they are needed on the host. Changes made to
+# the host arrays in between are not seen: create a new DeviceStepper after them.
+# The accelerations for the first kick are computed on the device, system.acc is not used
+class DeviceStepper(object):
+    def __init__(self, system, delta_t, G, eps2):
+        self.delta_t = delta_t
+        self.G = G
+        self.eps2 = eps2
+        self.n_blocks = (len(system) + TILE - 1) // TILE
+        self.d_pos = cuda.to_device(system.pos)
+        self.d_vel = cuda.to_device(system.vel)
+        self.d_acc = cuda.device_array((len(system), 3))
+        self.d_mass = cuda.to_device(system.mass)
+        _accel_tiled[self.n_blocks, TILE](self.d_pos, self.d_mass, self.d_acc, self.G, self.eps2)
+
+    def __call__(self, system):
+        half_delta_t = 0.5 * self.delta_t
+        grid = self.n_blocks, TILE
+        _kick_drift[grid](self.d_pos, self.d_vel, self.d_acc, half_delta_t, self.delta_t)
+        _accel_tiled[grid](self.d_pos, self.d_mass, self.d_acc, self.G, self.eps2)
+        _kick[grid](self.d_vel, self.d_acc, half_delta_t)
+        self.d_pos.copy_to_host(system.pos)
+
+    def sync(self, system):
+        self.d_vel.copy_to_host(system.vel)
+        self.d_acc.copy_to_host(system.acc)
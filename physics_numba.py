@@ -0,0 +1,262 @@
+# numba-compiled kernels for the n-body problem, working on plain arrays:
+# pos is (n, 3), mass is (n,), acc is (n, 3) and is overwritten,
+# eps2 is the squared softening length added to every r^2 (0 for plain Newtonian gravity)
+from functools import lru_cache
+import numpy as np
+from numba import njit, prange
+
+
+BLOCK = 64  # planets per tile: their coordinates and partial sums stay in L1 during the j sweep
+# (timings are flat between 16 and 128; 8 is too short for the inner loop to vectorize and ~2x slower)
+PAIRWISE_THRESHOLD = 4096  # above this many planets the j sums are accumulated pairwise
+PAIRWISE_CHUNK = 256  # planets summed directly before a partial sum enters the pairwise tree
+
+
+# n_threads is numba.get_num_threads() of the caller: it is an argument and not a global, which
+# numba would freeze into the cached machine code with the thread count of the first run
+@njit(fastmath=True, cache=True)
+def _block_size(n, n_threads):
+    # smaller blocks when there are fewer than BLOCK planets per thread, to keep every thread busy
+    return max(1, min(BLOCK, (n + n_threads - 1) // n_threads))
+
+
+# adds the contributions of the planets j0 <= j < j1 to the accelerations ax, ay, az of the
+# planets i0 <= i < i0 + m, whose coordinates are x_b, y_b, z_b: every j planet is loaded once
+# for the whole block instead of once per planet. gm is G * mass
+@njit(fastmath=True, cache=True)
+def _sweep(pos, gm, eps2, i0, x_b, y_b, z_b, j0, j1, ax, ay, az):
+    m = x_b.shape[0]
+    for j in range(j0, j1):
+        x_j = pos[j, 0]
+        y_j = pos[j, 1]
+        z_j = pos[j, 2]
+        gm_j = gm[j]
+        for ii in range(m):
+            if i0 + ii == j:
+                continue
+            dx = x_j - x_b[ii]
+            dy = y_j - y_b[ii]
+            dz = z_j - z_b[ii]
+            s = gm_j * (dx * dx + dy * dy + dz * dz + eps2) ** -1.5
+            ax[ii] += s * dx
+            ay[ii] += s * dy
+            az[ii] += s * dz
+
+
+# accelerations of the m planets starting at i0, accumulated into ax, ay, az.
+# gm is G * mass, computed once per call of the kernels instead of once per block and planet
+@njit(fastmath=True, cache=True)
+def _block_accelerations(pos, gm, eps2, i0, m, ax, ay, az):
+    n = pos.shape[0]
+    x_b = np.empty(m)
+    y_b = np.empty(m)
+    z_b = np.empty(m)
+    for ii in range(m):
+        x_b[ii] = pos[i0 + ii, 0]
+        y_b[ii] = pos[i0 + ii, 1]
+        z_b[ii] = pos[i0 + ii, 2]
+    if n <= PAIRWISE_THRESHOLD:
+        _sweep(pos, gm, eps2, i0, x_b, y_b, z_b, 0, n, ax, ay, az)
+        return
+
+    # pairwise summation over chunks of PAIRWISE_CHUNK planets: partial[level] holds the sum of
+    # 2^level chunks and equal levels are merged like the digits of a binary counter, so the
+    # rounding error grows with log(n) instead of n, at the cost of a few extra additions per chunk
+    n_chunks = (n + PAIRWISE_CHUNK - 1) // PAIRWISE_CHUNK
+    levels = 1
+    while (1 << levels) <= n_chunks:
+        levels += 1
+    partial = np.empty((levels, 3, m))
+    chunk = np.empty((3, m))
+    for c in range(n_chunks):
+        chunk[:, :] = 0.0
+        j0 = c * PAIRWISE_CHUNK
+        _sweep(pos, gm, eps2, i0, x_b, y_b, z_b, j0, min(j0 + PAIRWISE_CHUNK, n), chunk[0], chunk[1], chunk[2])
+        level = 0
+        k = c
+        while k & 1:
+            chunk += partial[level]
+            level += 1
+            k >>= 1
+        partial[level] = chunk
+    # the partial sums left are the set bits of n_chunks
+    for level in range(levels):
+        if (n_chunks >> level) & 1:
+            for ii in range(m):
+                ax[ii] += partial[level, 0, ii]
+                ay[ii] += partial[level, 1, ii]
+                az[ii] += partial[level, 2, ii]
+
+
+# the i-loop is tiled in blocks of at most BLOCK planets. Blocks are distributed over the
+# threads and each one only writes its own rows of acc, so unlike the symmetric kernel
+# there is no write race.
+@njit(parallel=True, fastmath=True, cache=True)
+def accel_kernel(pos, mass, acc, G, eps2, n_threads):
+    n = pos.shape[0]
+    gm = G * mass
+    block = _block_size(n, n_threads)
+    n_blocks = (n + block - 1) // block
+    for b in prange(n_blocks):
+        i0 = b * block
+        m = min(block, n - i0)
+        ax = np.zeros(m)
+        ay = np.zeros(m)
+        az = np.zeros(m)
+        _block_accelerations(pos, gm, eps2, i0, m, ax, ay, az)
+        for ii in range(m):
+            acc[i0 + ii, 0] = ax[ii]
+            acc[i0 + ii, 1] = ay[ii]
+            acc[i0 + ii, 2] = az[ii]
+
+
+# accel_kernel for float32 arrays, see PlanetSystem(dtype=np.float32): every pair term is computed
+# in single precision, with twice as many lanes per SIMD register. The sums over j run in float32
+# over chunks of PAIRWISE_CHUNK planets and the chunk sums are added up in float64, which keeps the
+# error of a float64 accumulator without converting every term. r^-3 is built from 1 / r so that
+# no intermediate gets out of the float32 range for astronomical distances and masses in SI units
+@njit(parallel=True, fastmath=True, cache=True)
+def accel_kernel_f32(pos, mass, acc, G, eps2, n_threads):
+    n = pos.shape[0]
+    gm = (G * mass).astype(np.float32)
+    eps2_f = np.float32(eps2)
+    one = np.float32(1.0)
+    block = _block_size(n, n_threads)
+    n_blocks = (n + block - 1) // block
+    for b in prange(n_blocks):
+        i0 = b * block
+        m = min(block, n - i0)
+        x_b = pos[i0:i0 + m, 0].copy()
+        y_b = pos[i0:i0 + m, 1].copy()
+        z_b = pos[i0:i0 + m, 2].copy()
+        ax = np.zeros(m)
+        ay = np.zeros(m)
+        az = np.zeros(m)
+        cx = np.empty(m, dtype=np.float32)
+        cy = np.empty(m, dtype=np.float32)
+        cz = np.empty(m, dtype=np.float32)
+        for j0 in range(0, n, PAIRWISE_CHUNK):
+            cx[:] = 0.0
+            cy[:] = 0.0
+            cz[:] = 0.0
+            for j in range(j0, min(j0 + PAIRWISE_CHUNK, n)):
+                x_j = pos[j, 0]
+                y_j = pos[j, 1]
+                z_j = pos[j, 2]
+                gm_j = gm[j]
+                for ii in range(m):
+                    if i0 + ii == j:
+                        continue
+                    dx = x_j - x_b[ii]
+                    dy = y_j - y_b[ii]
+                    dz = z_j - z_b[ii]
+                    inv_r = one / np.sqrt(dx * dx + dy * dy + dz * dz + eps2_f)
+                    s = gm_j * inv_r * inv_r * inv_r
+                    cx[ii] += s * dx
+                    cy[ii] += s * dy
+                    cz[ii] += s * dz
+            for ii in range(m):
+                ax[ii] += cx[ii]
+                ay[ii] += cy[ii]
+                az[ii] += cz[ii]
+        for ii in range(m):
+            acc[i0 + ii, 0] = ax[ii]
+            acc[i0 + ii, 1] = ay[ii]
+            acc[i0 + ii, 2] = az[ii]
+
+
+# accel_kernel followed by vel += acc * delta_t, applied while the accelerations of the block
+# are still in cache
+@njit(parallel=True, fastmath=True, cache=True)
+def accel_kick_kernel(pos, mass, acc, vel, G, eps2, delta_t, n_threads):
+    n = pos.shape[0]
+    gm = G * mass
+    block = _block_size(n, n_threads)
+    n_blocks = (n + block - 1) // block
+    for b in prange(n_blocks):
+        i0 = b * block
+        m = min(block, n - i0)
+        ax = np.zeros(m)
+        ay = np.zeros(m)
+        az = np.zeros(m)
+        _block_accelerations(pos, gm, eps2, i0, m, ax, ay, az)
+        for ii in range(m):
+            i = i0 + ii
+            acc[i, 0] = ax[ii]
+            acc[i, 1] = ay[ii]
+            acc[i, 2] = az[ii]
+            vel[i, 0] += ax[ii] * delta_t
+            vel[i, 1] += ay[ii] * delta_t
+            vel[i, 2] += az[ii] * delta_t
+
+
+# vel += acc * kick_t followed by pos += vel * drift_t, in a single pass over the arrays
+@njit(parallel=True, fastmath=True, cache=True)
+def kick_drift_kernel(pos, vel, acc, kick_t, drift_t):
+    for i in prange(pos.shape[0]):
+        for d in range(3):
+            v = vel[i, d] + acc[i, d] * kick_t
+            vel[i, d] = v
+            pos[i, d] += v * drift_t
+
+
+# visits every pair once and applies it to both planets (Newton's third law): half the work of
+# accel_kernel, but the writes to acc[j] make the outer loop unsafe to run in parallel
+@njit(fastmath=True, cache=True)
+def accel_kernel_symmetric(pos, mass, acc, G, eps2):
+    n = pos.shape[0]
+    gm = G * mass
+    acc[:, :] = 0.0
+    for i in range(n):
+        x_i = pos[i, 0]
+        y_i = pos[i, 1]
+        z_i = pos[i, 2]
+        gm_i = gm[i]
+        ax = 0.0
+        ay = 0.0
+        az = 0.0
+        for j in range(i + 1, n):
+            dx = pos[j, 0] - x_i
+            dy = pos[j, 1] - y_i
+            dz = pos[j, 2] - z_i
+            inv_r3 = (dx * dx + dy * dy + dz * dz + eps2) ** -1.5
+            s_i = gm[j] * inv_r3
+            s_j = gm_i * inv_r3
+            ax += s_i * dx
+            ay += s_i * dy
+            az += s_i * dz
+            acc[j, 0] -= s_j * dx
+            acc[j, 1] -= s_j * dy
+            acc[j, 2] -= s_j * dz
+        acc[i, 0] += ax
+        acc[i, 1] += ay
+        acc[i, 2] += az
+
+
+# a compiled velocity Verlet step for fixed delta_t, G and eps2: they are frozen into the machine
+# code as constants. Small systems get a serial step on the symmetric kernel, which avoids
+# starting the thread pool twice per step. numba caches each set of constants on disk, and
+# lru_cache avoids recompiling within a run
+@lru_cache(maxsize=None)
+def make_verlet_step(delta_t, G, eps2, symmetric):
+    half_delta_t = 0.5 * delta_t
+
+    if symmetric:
+        @njit(fastmath=True, cache=True)
+        def step(pos, vel, acc, mass, n_threads):
+            n = pos.shape[0]
+            for i in range(n):
+                for d in range(3):
+                    v = vel[i, d] + acc[i, d] * half_delta_t
+                    vel[i, d] = v
+                    pos[i, d] += v * delta_t
+            accel_kernel_symmetric(pos, mass, acc, G, eps2)
+            for i in range(n):
+                for d in range(3):
+                    vel[i, d] += acc[i, d] * half_delta_t
+    else:
+        @njit(fastmath=True, cache=True)  # the two kernels it calls are parallel themselves
+        def step(pos, vel, acc, mass, n_threads):
+            kick_drift_kernel(pos, vel, acc, half_delta_t, delta_t)
+            accel_kick_kernel(pos, mass, acc, vel, G, eps2, half_delta_t, n_threads)
+    return step
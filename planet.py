@@ -3,8 +3,20 @@ from typing import List
 from constants import R_earth, R_sun, M_earth, M_sun, D_earth_sun, V_earth
 import numpy as np
 
+FOUR_THIRDS_PI = 4.0 / 3.0 * math.pi
+
+try:
+    from scipy.spatial.distance import cdist, pdist
+except ImportError:  # scipy is optional, the distances are then computed with NumPy
+    cdist = None
+    pdist = None
+
+PAIRS_PER_CHUNK = 1 << 20  # distances computed at once by colliding_pairs, bounds its memory use
+
 
 class planet(object):
+    __slots__ = ('name', 'radius', 'mass', 'x', 'y', 'z', 'x_v', 'y_v', 'z_v', 'x_a', 'y_a', 'z_a')
+
     def __init__(self,
                  name,
                  radius=1.0,
@@ -25,8 +37,10 @@ class planet(object):
         self.y_a = y_a
         self.z_a = z_a
 
+    # r * r * r instead of r ** 3.0, which goes through pow. Not cached: radius changes on merges
     def volume(self) -> float:
-        return (4.0 / 3.0) * math.pi * (self.radius ** 3.0)
+        r = self.radius
+        return FOUR_THIRDS_PI * (r * r * r)
 
     def density(self) -> float:
         return self.mass / self.volume()
@@ -41,6 +55,18 @@ class planet(object):
         self.y_v += self.y_a * delta_t
         self.z_v += self.z_a * delta_t
 
+    # update_velocity followed by update_position, reading every attribute only once
+    def step(self, delta_t):
+        x_v = self.x_v + self.x_a * delta_t
+        y_v = self.y_v + self.y_a * delta_t
+        z_v = self.z_v + self.z_a * delta_t
+        self.x += x_v * delta_t
+        self.y += y_v * delta_t
+        self.z += z_v * delta_t
+        self.x_v = x_v
+        self.y_v = y_v
+        self.z_v = z_v
+
     def clear_acceleration(self) -> object:
         self.x_a = 0.0
         self.y_a = 0.0
@@ -51,62 +77,291 @@ class planet(object):
         self.y_a += dy_a
         self.z_a += dz_a
 
+    def summary(self) -> str:
+        return "\n".join(("Planet %s , mass %.2f, radius %.2f :" % (self.name, self.mass, self.radius),
+                          "    * position:     ( %.2f, %.2f, %.2f)" % (self.x, self.y, self.z),
+                          "    * velocity:     ( %.2f, %.2f, %.2f)" % (self.x_v, self.y_v, self.z_v),
+                          "    * acceleration: ( %.2f, %.2f, %.2f)" % (self.x_a, self.y_a, self.z_a)))
+
+    def report(self):
+        print(self.summary())
+
+
+def _row_property(array):
+    # reads and writes element i of one of the arrays of a PlanetSystem
+    def fget(self):
+        return float(getattr(self.system, array)[self.i])
+
+    def fset(self, value):
+        getattr(self.system, array)[self.i] = value
+    return property(fget, fset)
+
+
+def _column_property(array, column):
+    # reads and writes one coordinate of row i of one of the (n, 3) arrays of a PlanetSystem
+    def fget(self):
+        return float(getattr(self.system, array)[self.i, column])
+
+    def fset(self, value):
+        getattr(self.system, array)[self.i, column] = value
+    return property(fget, fset)
+
+
+# a planet-like handle on row i of a PlanetSystem, there is no copy: changes go to the system arrays
+class PlanetView(object):
+    __slots__ = ('system', 'i')
+
+    def __init__(self, system, i):
+        self.system = system
+        self.i = i
+
+    @property
+    def name(self):
+        return self.system.names[self.i]
+
+    @name.setter
+    def name(self, value):
+        self.system.names[self.i] = value
+
+    radius = _row_property('radius')
+    mass = _row_property('mass')
+    x = _column_property('pos', 0)
+    y = _column_property('pos', 1)
+    z = _column_property('pos', 2)
+    x_v = _column_property('vel', 0)
+    y_v = _column_property('vel', 1)
+    z_v = _column_property('vel', 2)
+    x_a = _column_property('acc', 0)
+    y_a = _column_property('acc', 1)
+    z_a = _column_property('acc', 2)
+
+    volume = planet.volume
+    density = planet.density
+    update_position = planet.update_position
+    update_velocity = planet.update_velocity
+    step = planet.step
+    clear_acceleration = planet.clear_acceleration
+    append_acceleration = planet.append_acceleration
+    summary = planet.summary
+    report = planet.report
+
+
+# one planet as a record, the array-of-structs layout of a PlanetSystem (without the names)
+planet_dtype = np.dtype([('radius', 'f8'), ('mass', 'f8'), ('pos', 'f8', (3,)), ('vel', 'f8', (3,)),
+                         ('acc', 'f8', (3,))])
+
+
+class PlanetSystem(object):
+    # struct-of-arrays storage of a list of planets: row i of every array belongs to planet i.
+    # softening (in m) is added in quadrature to the distances in the force law, 0 for none.
+    # dtype=np.float32 halves the memory traffic and doubles the SIMD width of the force kernel
+    # for large systems, at about 1e-5 relative error on the accelerations (float64 by default)
+    def __init__(self, planets=(), softening=0.0, dtype=np.float64):
+        self.softening = softening
+        self.dtype = np.dtype(dtype)
+        self.names = []
+        self.radius = np.empty(0, dtype=self.dtype)
+        self.mass = np.empty(0, dtype=self.dtype)
+        self.pos = np.empty((0, 3), dtype=self.dtype)
+        self.vel = np.empty((0, 3), dtype=self.dtype)
+        self.acc = np.empty((0, 3), dtype=self.dtype)
+        self._tmp = np.empty((0, 3), dtype=self.dtype)  # scratch for the in-place updates
+        planets = list(planets)
+        if planets:
+            # a single conversion for all planets instead of growing the arrays one planet at a time
+            self._set_records([p.name for p in planets], np.array(
+                [(p.radius, p.mass, (p.x, p.y, p.z), (p.x_v, p.y_v, p.z_v), (p.x_a, p.y_a, p.z_a))
+                 for p in planets], dtype=planet_dtype))
+
+    # records is an array of planet_dtype, it is copied into contiguous arrays of the system
+    @classmethod
+    def from_records(cls, records, names=None, softening=0.0, dtype=np.float64):
+        system = cls(softening=softening, dtype=dtype)
+        system._set_records([str(i) for i in range(len(records))] if names is None else list(names), records)
+        return system
+
+    def _set_records(self, names, records):
+        self.names = names
+        self.radius = np.ascontiguousarray(records['radius'], dtype=self.dtype)
+        self.mass = np.ascontiguousarray(records['mass'], dtype=self.dtype)
+        self.pos = np.ascontiguousarray(records['pos'], dtype=self.dtype)
+        self.vel = np.ascontiguousarray(records['vel'], dtype=self.dtype)
+        self.acc = np.ascontiguousarray(records['acc'], dtype=self.dtype)
+        self._tmp = np.empty_like(self.pos)
+
+    # the planets as an array of planet_dtype records (a copy), e.g. to save them with np.save
+    def to_records(self) -> np.ndarray:
+        records = np.empty(len(self), dtype=planet_dtype)
+        records['radius'] = self.radius
+        records['mass'] = self.mass
+        records['pos'] = self.pos
+        records['vel'] = self.vel
+        records['acc'] = self.acc
+        return records
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i) -> PlanetView:
+        n = len(self.names)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("planet index out of range")
+        return PlanetView(self, i)
+
+    def __iter__(self):
+        return (PlanetView(self, i) for i in range(len(self.names)))
+
+    def append(self, p):
+        self.names.append(p.name)
+        self.radius = np.concatenate((self.radius, (p.radius,)), dtype=self.dtype)
+        self.mass = np.concatenate((self.mass, (p.mass,)), dtype=self.dtype)
+        self.pos = np.vstack((self.pos, (p.x, p.y, p.z)), dtype=self.dtype)
+        self.vel = np.vstack((self.vel, (p.x_v, p.y_v, p.z_v)), dtype=self.dtype)
+        self.acc = np.vstack((self.acc, (p.x_a, p.y_a, p.z_a)), dtype=self.dtype)
+        self._tmp = np.empty_like(self.pos)
+
+    # x, y, z columns of pos as views, without copies (writing into them moves the planets).
+    # Properties rather than attributes set in __init__: append replaces pos with a bigger array
+    @property
+    def x(self) -> np.ndarray:
+        return self.pos[:, 0]
+
+    @property
+    def y(self) -> np.ndarray:
+        return self.pos[:, 1]
+
+    @property
+    def z(self) -> np.ndarray:
+        return self.pos[:, 2]
+
+    # creates a planet with the arguments of planet() straight in the system arrays,
+    # and returns its view
+    def add(self, *args, **kwargs) -> PlanetView:
+        self.append(planet(*args, **kwargs))
+        return PlanetView(self, len(self.names) - 1)
+
+    # independent copies, changing them does not affect the system
+    def to_planets(self) -> List[planet]:
+        return [planet(self.names[i], float(self.radius[i]), float(self.mass[i]),
+                       *self.pos[i].tolist(), *self.vel[i].tolist(), *self.acc[i].tolist())
+                for i in range(len(self))]
+
+    def update_position(self, delta_t):
+        np.multiply(self.vel, delta_t, out=self._tmp)
+        np.add(self.pos, self._tmp, out=self.pos)
+
+    def update_velocity(self, delta_t):
+        np.multiply(self.acc, delta_t, out=self._tmp)
+        np.add(self.vel, self._tmp, out=self.vel)
+
+    # one memset instead of three attribute writes per planet
+    def clear_acceleration(self):
+        self.acc.fill(0.0)
+
+    def summary(self) -> str:
+        return "\n".join(p.summary() for p in self)
+
     def report(self):
-        print("Planet", self.name, ", mass %.2f, radius %.2f" % (self.mass, self.radius), ":")
-        print("    * position:     ( %.2f, %.2f, %.2f)" % (self.x, self.y, self.z))
-        print("    * velocity:     ( %.2f, %.2f, %.2f)" % (self.x_v, self.y_v, self.z_v))
-        print("    * acceleration: ( %.2f, %.2f, %.2f)" % (self.x_a, self.y_a, self.z_a))
+        print(self.summary())
 
 
+# all the trajectories in a single array: history[i, k] is the position of planet i at the k-th
+# recorded time step, history[:, :k] is directly the (n, k, 3) segments array of a Line3DCollection
+# and history[:, :, 0] the (n, n_steps) x coordinates, as recorded by snapshot.
+# dtype=np.float32 is enough when the history is only plotted (matplotlib draws in single precision)
+def set_up_history(n, n_steps, dtype=np.float64):
+    return np.empty((n, n_steps, 3), dtype=dtype)
+
+
+# records the (n, 3) positions pos as time step k of the history made by set_up_history
+def snapshot_history(history, k, pos):
+    history[:, k] = pos
+
+
+# trajectories as (n, n_steps) arrays, e.g. the views history[:, :, 0], history[:, :, 1] and
+# history[:, :, 2] of set_up_history: records the (n, 3) positions pos as column k of x, y and z
+def snapshot(x, y, z, k, pos):
+    x[:, k] = pos[:, 0]
+    y[:, k] = pos[:, 1]
+    z[:, k] = pos[:, 2]
+
+
+# the former list based recording, kept for existing callers: x, y and z get one (empty) list
+# per planet in set_up_positions, append_positions then appends the current coordinates of
+# planets (a list of planets or a PlanetSystem) to them
 def set_up_positions(x, y, z, n):
-    i = 0
-    while i < n:
+    for _ in range(n):
         x.append([])
         y.append([])
         z.append([])
-        i += 1
 
 
 def append_positions(x, y, z, planets):
-    n = len(planets)
-    i = 0
-    while i < n:
-        p = planets[i]
-        x[i].append(p.x)
-        y[i].append(p.y)
-        z[i].append(p.z)
-        i += 1
+    if isinstance(planets, PlanetSystem):
+        pos = planets.pos.tolist()  # one conversion instead of one per coordinate
+    else:
+        pos = [(p.x, p.y, p.z) for p in planets]
+    for i, (p_x, p_y, p_z) in enumerate(pos):
+        x[i].append(p_x)
+        y[i].append(p_y)
+        z[i].append(p_z)
 
 
 def distance_between_planets(p_lhs, p_rhs) -> float:
-    return math.sqrt((p_lhs.x - p_rhs.x) ** 2.0 +
-                     (p_lhs.y - p_rhs.y) ** 2.0 +
-                     (p_lhs.z - p_rhs.z) ** 2.0)
+    dx = p_lhs.x - p_rhs.x
+    dy = p_lhs.y - p_rhs.y
+    dz = p_lhs.z - p_rhs.z
+    return math.sqrt(dx * dx + dy * dy + dz * dz)
+
+
+# all the n (n - 1) / 2 distances of a PlanetSystem as a condensed vector,
+# in the order of pdist: (0, 1), (0, 2), ..., (0, n - 1), (1, 2), ...
+def all_pairwise_distances(system) -> np.ndarray:
+    return _pairwise_distances(system.pos)
 
 
-def combine_planets(p_lhs, p_rhs) -> planet:
+# all_pairwise_distances for the (n, 3) positions pos
+def _pairwise_distances(pos) -> np.ndarray:
+    if pdist is not None:
+        return pdist(pos)
+    i, j = np.triu_indices(len(pos), 1)
+    d = pos[j] - pos[i]
+    return np.sqrt(np.einsum('ij,ij->i', d, d))
+
+
+# distances from every planet of pos_lhs to every planet of pos_rhs, an (n_lhs, n_rhs) array
+def _distances(pos_lhs, pos_rhs) -> np.ndarray:
+    if cdist is not None:
+        return cdist(pos_lhs, pos_rhs)
+    d = pos_rhs[None, :, :] - pos_lhs[:, None, :]
+    return np.sqrt(np.einsum('ijk,ijk->ij', d, d))
+
+
+# combines any number of planets into a single one in one pass
+def combine_planets(*planets) -> planet:
     # new name
-    new_name = p_lhs.name + p_rhs.name
+    new_name = "".join(p.name for p in planets)
 
     # new mass
-    new_mass = p_lhs.mass + p_rhs.mass
-    w_lhs = p_lhs.mass / new_mass
-    w_rhs = 1.0 - w_lhs
+    new_mass = sum(p.mass for p in planets)
+    inv_new_mass = 1.0 / new_mass
+    w = [p.mass * inv_new_mass for p in planets]
 
-    # new density and radius
-    new_volume = p_lhs.volume() + p_rhs.volume()
-    new_radius = (new_volume * (3.0 / 4.0) / math.pi) ** (1.0 / 3.0)
+    # new radius: the volume is conserved, and the 4 / 3 pi factors cancel out
+    new_radius = sum(p.radius * p.radius * p.radius for p in planets) ** (1.0 / 3.0)
 
-    # new position: we pick a point between the two centers,
+    # new position: we pick a point between the centers,
     # giving more weight to bigger objects
-    new_x = p_lhs.x * w_lhs + p_rhs.x * w_rhs
-    new_y = p_lhs.y * w_lhs + p_rhs.y * w_rhs
-    new_z = p_lhs.z * w_lhs + p_rhs.z * w_rhs
+    new_x = sum(p.x * w_p for p, w_p in zip(planets, w))
+    new_y = sum(p.y * w_p for p, w_p in zip(planets, w))
+    new_z = sum(p.z * w_p for p, w_p in zip(planets, w))
 
     # new velocity: conservation of momentum
-    new_x_v = p_lhs.x_v * w_lhs + p_rhs.x_v * w_rhs
-    new_y_v = p_lhs.y_v * w_lhs + p_rhs.y_v * w_rhs
-    new_z_v = p_lhs.z_v * w_lhs + p_rhs.z_v * w_rhs
+    new_x_v = sum(p.x_v * w_p for p, w_p in zip(planets, w))
+    new_y_v = sum(p.y_v * w_p for p, w_p in zip(planets, w))
+    new_z_v = sum(p.z_v * w_p for p, w_p in zip(planets, w))
 
     # new acceleration: set it to zero, it will be computed in next iteration
     new_x_a = 0.0
@@ -119,34 +374,55 @@ def combine_planets(p_lhs, p_rhs) -> planet:
                   new_x_a, new_y_a, new_z_a)
 
 
-def create_new_planet_list(i_lhs, i_rhs, new_planet, old_list):
-    new_list = old_list
-    if i_lhs < i_rhs:
-        new_list.pop(i_rhs)
-        new_list.pop(i_lhs)
-    else:
-        new_list.pop(i_lhs)
-        new_list.pop(i_rhs)
-    new_list.append(new_planet)
-    return new_list
+def colliding_pairs(pos, radius) -> np.ndarray:
+    # (i, j) index pairs, i < j, of planets closer than the larger of their two radii
+    n = len(radius)
+    if n * (n - 1) // 2 <= PAIRS_PER_CHUNK:
+        i, j = np.triu_indices(n, 1)
+        close = _pairwise_distances(pos) < np.maximum(radius[i], radius[j])
+        return np.stack((i[close], j[close]), axis=1)
+
+    # too many pairs to hold at once: the upper triangle is processed in blocks of rows
+    rows = max(1, PAIRS_PER_CHUNK // n)
+    pairs = []
+    for i0 in range(0, n, rows):
+        i1 = min(i0 + rows, n)
+        dist = _distances(pos[i0:i1], pos[i0:])
+        close = np.triu(dist < np.maximum(radius[i0:i1, None], radius[None, i0:]), 1)
+        block_pairs = np.argwhere(close)
+        block_pairs += i0
+        pairs.append(block_pairs)
+    return np.concatenate(pairs)
+
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
 
 
 def check_for_colliding_planets(planets: List[planet]) -> List[planet]:
-    n = len(planets)
-    i_lhs = 0
-    while i_lhs < n - 1:
-        p_lhs = planets[i_lhs]
-        i_rhs = i_lhs + 1
-        while i_rhs < n:
-            p_rhs = planets[i_rhs]
-            larger_radius = max(p_lhs.radius, p_rhs.radius)
-            distance = distance_between_planets(p_lhs, p_rhs)
-            if distance < larger_radius:
-                new_planet = combine_planets(p_lhs, p_rhs)
-                new_planets = create_new_planet_list(i_lhs, i_rhs, new_planet, planets)
-                return check_for_colliding_planets(new_planets)
-            i_rhs += 1
-        i_lhs += 1
+    # merged planets are bigger and may now touch others, so repeat until nothing collides
+    while len(planets) > 1:
+        n = len(planets)
+        pos = np.array([(p.x, p.y, p.z) for p in planets])
+        radius = np.array([p.radius for p in planets])
+        pairs = colliding_pairs(pos, radius)
+        if len(pairs) == 0:
+            break
+
+        # union-find: every connected group of colliding planets becomes a single planet
+        parent = list(range(n))
+        for i_lhs, i_rhs in pairs.tolist():
+            parent[_find(parent, i_lhs)] = _find(parent, i_rhs)
+        groups = {}
+        for i in range(n):
+            groups.setdefault(_find(parent, i), []).append(planets[i])
+
+        survivors = [group[0] for group in groups.values() if len(group) == 1]
+        merged = [combine_planets(*group) for group in groups.values() if len(group) > 1]
+        planets = survivors + merged
     return planets
 
 